@@ -0,0 +1,330 @@
+import asyncio
+import os
+import subprocess
+import sys
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import orjson
+import pytest
+import requests
+from prefect import flow, task
+from prefect.testing.utilities import prefect_test_harness
+from pydantic import SecretStr
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+@pytest.fixture(scope="module")
+def github():
+    # Importing the workflow registers the GitHub block, which needs a token
+    # and a Prefect API, so import it inside a temporary Prefect server
+    os.environ.setdefault("GITHUB_TOKEN", "test-token")
+    with prefect_test_harness():
+        from workflows import github
+        yield github
+
+
+def _retry_options(github):
+    return {**github.GITHUB_RETRY_OPTIONS, "retry_delay_seconds": 0}
+
+
+def test_async_task_retries_transient_git_error(github):
+    attempts = []
+
+    @task(**_retry_options(github))
+    async def clone():
+        attempts.append(1)
+        raise subprocess.CalledProcessError(
+            128, ["git", "clone"], stderr="fatal: unable to access: The requested URL returned error: 502"
+        )
+
+    @flow
+    async def backup():
+        await clone()
+
+    with pytest.raises(subprocess.CalledProcessError):
+        asyncio.run(backup())
+    assert len(attempts) == 4
+
+
+def test_async_task_does_not_retry_other_errors(github):
+    attempts = []
+
+    @task(**_retry_options(github))
+    async def clone():
+        attempts.append(1)
+        raise subprocess.CalledProcessError(
+            128, ["git", "clone"], stderr="fatal: repository not found"
+        )
+
+    @flow
+    async def backup():
+        await clone()
+
+    with pytest.raises(subprocess.CalledProcessError):
+        asyncio.run(backup())
+    assert len(attempts) == 1
+
+
+def test_async_task_retries_stalled_git_transfer(github):
+    attempts = []
+
+    @task(**_retry_options(github))
+    async def clone():
+        attempts.append(1)
+        raise subprocess.CalledProcessError(
+            128, ["git", "clone"],
+            stderr=(
+                "error: RPC failed; curl 28 Operation too slow. Less than 1000 bytes/sec "
+                "transferred the last 60 seconds\nfatal: early EOF\n"
+                "fatal: fetch-pack: invalid index-pack output"
+            ),
+        )
+
+    @flow
+    async def backup():
+        await clone()
+
+    with pytest.raises(subprocess.CalledProcessError):
+        asyncio.run(backup())
+    assert len(attempts) == 4
+
+
+def test_sync_task_retries_transient_api_error(github):
+    attempts = []
+
+    @task(**_retry_options(github))
+    def list_repositories():
+        attempts.append(1)
+        raise RuntimeError("Error encountered:\nHTTP Error 502: Bad Gateway")
+
+    @flow
+    def backup():
+        list_repositories()
+
+    with pytest.raises(RuntimeError):
+        backup()
+    assert len(attempts) == 4
+
+
+def test_failed_commit_history_is_not_cached(github, monkeypatch):
+    owner = f"owner-{uuid.uuid4().hex}"
+    until_date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    calls = []
+
+    def unauthorized(*args, **variables):
+        calls.append(args[1])
+        raise RuntimeError("Error encountered:\nHTTP Error 401: Unauthorized")
+
+    def history(*args, **variables):
+        calls.append(args[1])
+        return {"repo0": {"defaultBranchRef": {"target": {"history": {"nodes": [
+            {"oid": "abc", "message": "init", "committedDate": "2023-12-31T00:00:00Z"},
+        ]}}}}}
+
+    @flow
+    def backup():
+        return github.get_repository_commits(owner, "repo", None, until_date)
+
+    monkeypatch.setattr(github, "_execute_graphql", unauthorized)
+    with pytest.raises(RuntimeError):
+        backup()
+
+    monkeypatch.setattr(github, "_execute_graphql", history)
+    assert [commit["sha"] for commit in backup()] == ["abc"]
+    assert len(calls) == 2
+
+
+def test_commit_history_cache_key_fits_in_a_file_name(github):
+    parameters = {
+        "owner": "me",
+        "repo_names": [f"a-rather-long-repository-name-{i}" for i in range(60)],
+        "until_date": datetime(2024, 1, 1, tzinfo=timezone.utc),
+        "max_commits": 100,
+    }
+    key = github._commit_history_cache_key(None, parameters)
+
+    assert len(key) < 255
+    assert key != github._commit_history_cache_key(None, {**parameters, "max_commits": 50})
+    assert key != github._commit_history_cache_key(
+        None, {**parameters, "repo_names": parameters["repo_names"][:59]}
+    )
+
+
+def _git(*args, cwd=None):
+    return subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=cwd, check=True, capture_output=True, text=True,
+    ).stdout
+
+
+def test_mirror_follows_renamed_default_branch(github, tmp_path):
+    upstream = tmp_path / "upstream"
+    _git("init", "-q", "-b", "master", str(upstream))
+    (upstream / "README").write_text("hello\n")
+    _git("add", "README", cwd=upstream)
+    _git("commit", "-q", "-m", "initial", cwd=upstream)
+
+    repo_info = {
+        "name": "upstream",
+        "url": upstream.as_uri(),
+        "clone_url": upstream.as_uri(),
+        "is_private": False,
+        "is_fork": False,
+        "default_branch": "master",
+    }
+
+    @flow
+    async def backup(snapshot: str, repo_info: dict):
+        return await github.clone_repository_to_local(
+            repo_info, "", tmp_path / "repositories" / snapshot, tmp_path / "mirrors"
+        )
+
+    asyncio.run(backup("2024-01-01", repo_info))
+
+    _git("branch", "-m", "master", "main", cwd=upstream)
+    snapshot = asyncio.run(backup("2024-01-02", {**repo_info, "default_branch": "main"}))
+
+    assert github._read_default_branch(snapshot) == "main"
+    assert _git("--git-dir", str(snapshot), "log", "--format=%s") == "initial\n"
+
+
+def test_repository_listing_retries_only_the_failing_page(github, monkeypatch):
+    cursors = []
+
+    def execute(credentials, query, login, after):
+        cursors.append(after)
+        if after is None:
+            return {"repositoryOwner": {"repositories": {
+                "nodes": [{"name": "b"}],
+                "pageInfo": {"hasNextPage": True, "endCursor": "page2"},
+            }}}
+        raise RuntimeError("Error encountered:\nHTTP Error 502: Bad Gateway")
+
+    monkeypatch.setattr(github, "_execute_graphql", execute)
+    monkeypatch.setattr(github.time, "sleep", lambda seconds: None)
+
+    @flow
+    def backup():
+        return github.get_all_repositories("me", None)
+
+    with pytest.raises(RuntimeError):
+        backup()
+    # Page 1 once, page 2 on every attempt, and no task-level restart
+    assert cursors == [None, "page2", "page2", "page2", "page2"]
+
+
+def test_full_clone_refetches_blobless_mirror(github, tmp_path):
+    upstream = tmp_path / "upstream"
+    _git("init", "-q", "-b", "main", str(upstream))
+    _git("config", "uploadpack.allowFilter", "true", cwd=upstream)
+    (upstream / "README").write_text("hello\n")
+    _git("add", "README", cwd=upstream)
+    _git("commit", "-q", "-m", "initial", cwd=upstream)
+
+    repo_info = {
+        "name": "upstream",
+        "url": upstream.as_uri(),
+        "clone_url": upstream.as_uri(),
+        "is_private": False,
+        "is_fork": False,
+        "default_branch": "main",
+    }
+
+    @flow
+    async def backup(snapshot: str, partial_clone: bool):
+        return await github.clone_repository_to_local(
+            repo_info, "", tmp_path / "repositories" / snapshot, tmp_path / "mirrors",
+            partial_clone=partial_clone,
+        )
+
+    asyncio.run(backup("2024-01-01", True))
+    assert github._is_partial_mirror(tmp_path / "mirrors" / "upstream.git")
+
+    # A refetch that fails leaves the mirror marked partial so it is retried
+    upstream.rename(tmp_path / "offline")
+    with pytest.raises(subprocess.CalledProcessError):
+        asyncio.run(backup("2024-01-02", False))
+    assert github._is_partial_mirror(tmp_path / "mirrors" / "upstream.git")
+    (tmp_path / "offline").rename(upstream)
+
+    snapshot = asyncio.run(backup("2024-01-02", False))
+
+    assert not github._is_partial_mirror(tmp_path / "mirrors" / "upstream.git")
+    _git("--git-dir", str(snapshot), "fsck")
+    assert _git("--git-dir", str(snapshot), "show", "HEAD:README") == "hello\n"
+
+
+@pytest.mark.parametrize("write_commits_parquet", [False, True])
+def test_commits_parquet_is_opt_in(github, tmp_path, write_commits_parquet):
+    if write_commits_parquet:
+        pytest.importorskip("pyarrow")
+
+    upstream = tmp_path / "upstream"
+    _git("init", "-q", "-b", "main", str(upstream))
+    (upstream / "README").write_text("hello\n")
+    _git("add", "README", cwd=upstream)
+    _git("commit", "-q", "-m", "initial", cwd=upstream)
+
+    repo_info = {
+        "name": "upstream",
+        "url": upstream.as_uri(),
+        "clone_url": upstream.as_uri(),
+        "is_private": False,
+        "is_fork": False,
+        "default_branch": "main",
+    }
+
+    @flow
+    async def backup():
+        return await github.process_repository(
+            repo_info, "", datetime.now(timezone.utc),
+            tmp_path / "repositories" / "snapshot", tmp_path / "mirrors",
+            write_commits_parquet=write_commits_parquet,
+        )
+
+    result = asyncio.run(backup())
+
+    assert result["commit_count"] == 1
+    assert (Path(result["local_path"]) / "commits.parquet").exists() == write_commits_parquet
+
+
+def test_partial_graphql_errors_are_not_cached_as_empty_history(github, monkeypatch):
+    class Response:
+        ok = True
+        content = orjson.dumps({
+            "data": {"repo0": None},
+            "errors": [{"type": "NOT_FOUND", "path": ["repo0"], "message": "Could not resolve"}],
+        })
+
+    class Session:
+        def post(self, *args, **kwargs):
+            return Response()
+
+    class Credentials:
+        token = SecretStr("test-token")
+
+    monkeypatch.setattr(github, "_get_http_session", Session)
+
+    @flow
+    def backup():
+        return github.get_repository_commits(
+            f"owner-{uuid.uuid4().hex}", "repo", Credentials(), datetime(2024, 1, 1, tzinfo=timezone.utc)
+        )
+
+    with pytest.raises(RuntimeError, match="NOT_FOUND"):
+        backup()
+
+
+@pytest.mark.parametrize("error, transient", [
+    (RuntimeError("Error encountered:\nHTTP Error 502: Bad Gateway"), True),
+    (RuntimeError("Error encountered:\nHTTP Error 503: Service Unavailable"), True),
+    (RuntimeError("Error encountered:\nHTTP Error 504: Gateway Timeout"), True),
+    (requests.ReadTimeout("Read timed out. (read timeout=60)"), True),
+    (requests.ConnectionError("Connection aborted."), True),
+    (RuntimeError("Error encountered:\nHTTP Error 401: Unauthorized"), False),
+])
+def test_transient_github_errors(github, error, transient):
+    assert github._is_transient_github_error(error) is transient
@@ -1,7 +1,14 @@
+import functools
+import heapq
 import json
 import os
+import shutil
 import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
+from operator import itemgetter
 from pathlib import Path
 from typing import Optional
 import webbrowser
@@ -9,6 +16,11 @@ from urllib.parse import urlparse, parse_qs
 import wsgiref.simple_server
 import wsgiref.util
 
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
@@ -27,21 +39,58 @@ SCOPES = [
     'https://www.googleapis.com/auth/photoslibrary',  # Added broader scope for API access
 ]
 
+# Media downloads are network-bound, so several run at once on a thread pool
+MAX_DOWNLOAD_WORKERS = 16
+
+# (connect, read) timeouts in seconds and copy buffer size for media downloads
+DOWNLOAD_TIMEOUT = (10, 60)
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# baseUrls expire about an hour after listing; refresh them with batchGet
+# (at most 50 IDs per call) once the listing is older than this
+BASE_URL_MAX_AGE_SECONDS = 50 * 60
+BATCH_GET_SIZE = 50
+
+# Per-item metadata, one JSON object per line, next to media_metadata.json
+ITEMS_FILENAME = "items.jsonl"
+
 # Workaround for oauthlib being strict about scope changes
 import os
 os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'
 
+# Serializes token loading/refresh so concurrent callers don't race on token.json
+_AUTH_LOCK = threading.Lock()
+
 
 def get_authenticated_service(credentials_path: str):
     """
     Authenticate with Google Photos API using OAuth2.
 
+    The credentials are loaded once per credentials path and cached for the
+    life of the process; they refresh themselves when the access token
+    expires or a request is rejected with 401, so token.json is only read
+    once. The service itself is built on every call: googleapiclient services
+    (and their httplib2 transport) are not thread-safe, so concurrent flow
+    runs must not share one.
+
     Args:
         credentials_path: Path to the OAuth2 credentials JSON file
 
     Returns:
         Authenticated Google Photos service object
     """
+    creds = _load_credentials(credentials_path)
+    return build('photoslibrary', 'v1', credentials=creds, static_discovery=False)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_credentials(credentials_path: str) -> Credentials:
+    """Load or refresh the OAuth2 token, running the browser flow if needed."""
+    with _AUTH_LOCK:
+        return _authorize(credentials_path)
+
+
+def _authorize(credentials_path: str) -> Credentials:
     creds = None
     token_path = Path.home() / ".google-photos-tokens" / "token.json"
     token_path.parent.mkdir(parents=True, exist_ok=True)
@@ -124,9 +173,146 @@ def get_authenticated_service(credentials_path: str):
             json.dump(token_data, token, indent=2)
         print(f"Token saved to {token_path}")
 
-    # Build the service
-    service = build('photoslibrary', 'v1', credentials=creds, static_discovery=False)
-    return service
+    return creds
+
+
+def create_download_session() -> requests.Session:
+    """
+    Create an HTTP session for media downloads.
+
+    The connection pool is sized for MAX_DOWNLOAD_WORKERS so every worker
+    thread reuses a kept-alive connection, and transient failures are retried
+    with backoff.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=MAX_DOWNLOAD_WORKERS,
+        pool_maxsize=MAX_DOWNLOAD_WORKERS,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def download_media_item(
+    item: dict,
+    creation_time: datetime,
+    backup_path: Path,
+    session: requests.Session,
+) -> dict:
+    """
+    Download one media item and build its metadata record.
+
+    Args:
+        item: Media item returned by the mediaItems API
+        creation_time: The item's creation time (UTC)
+        backup_path: Snapshot directory to download into
+        session: Shared HTTP session for downloads
+
+    Returns:
+        Metadata dictionary for the downloaded item
+    """
+    # Download the media file
+    # Get the base URL and append download parameters
+    base_url = item['baseUrl']
+
+    # Determine if it's a photo or video
+    mime_type = item['mimeType']
+    is_video = mime_type.startswith("video/")
+
+    # Get file extension from mime type
+    if is_video:
+        download_url = f"{base_url}=dv"  # Download video
+        extension = mime_type.split("/")[-1]  # e.g., "mp4" from "video/mp4"
+    else:
+        download_url = f"{base_url}=d"  # Download photo at full resolution
+        extension = mime_type.split("/")[-1]  # e.g., "jpeg" from "image/jpeg"
+
+    # Create filename using item ID and extension
+    filename = f"{item['id']}.{extension}"
+    file_path = backup_path / filename
+
+    # Files are only renamed into place once fully written, so an existing
+    # file is complete and an interrupted run can skip it when resumed
+    if not file_path.exists():
+        part_path = file_path.with_name(f"{filename}.part")
+
+        # Stream the file straight to disk so large videos are never held in memory
+        with session.get(download_url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with open(part_path, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=DOWNLOAD_CHUNK_SIZE)
+
+        os.replace(part_path, file_path)
+
+    # Save metadata for this item
+    media_metadata = item['mediaMetadata']
+    metadata = {
+        "id": item['id'],
+        "filename": item.get('filename', filename),
+        "creation_time": creation_time.isoformat(),
+        "mime_type": mime_type,
+        "is_video": is_video,
+        "width": media_metadata.get('width'),
+        "height": media_metadata.get('height'),
+        "description": item.get("description", ""),
+        "local_path": str(file_path),
+    }
+
+    # Save photo-specific metadata
+    if 'photo' in media_metadata:
+        photo_metadata = media_metadata['photo']
+        metadata["camera_make"] = photo_metadata.get("cameraMake", "")
+        metadata["camera_model"] = photo_metadata.get("cameraModel", "")
+        metadata["focal_length"] = photo_metadata.get("focalLength", 0.0)
+        metadata["aperture_f_number"] = photo_metadata.get("apertureFNumber", 0.0)
+        metadata["iso_equivalent"] = photo_metadata.get("isoEquivalent", 0)
+
+    # Save video-specific metadata
+    if 'video' in media_metadata:
+        video_metadata = media_metadata['video']
+        metadata["fps"] = video_metadata.get("fps", 0.0)
+        metadata["status"] = video_metadata.get("status", "")
+
+    return metadata
+
+
+def iter_fresh_media_items(service, all_items: list, listed_at: float):
+    """
+    Yield (creation_time, item_id, item) entries from all_items, refreshing
+    their baseUrls just in time.
+
+    Once the listing is older than BASE_URL_MAX_AGE_SECONDS, each chunk of
+    BATCH_GET_SIZE items is re-fetched with mediaItems.batchGet right before
+    it is handed out, so long-running backups don't hit expired URLs.
+    """
+    for start in range(0, len(all_items), BATCH_GET_SIZE):
+        chunk = all_items[start:start + BATCH_GET_SIZE]
+
+        if time.monotonic() - listed_at > BASE_URL_MAX_AGE_SECONDS:
+            try:
+                results = service.mediaItems().batchGet(
+                    mediaItemIds=[item_id for _, item_id, _ in chunk],
+                ).execute()
+                fresh_items = {
+                    result["mediaItem"]["id"]: result["mediaItem"]
+                    for result in results.get("mediaItemResults", [])
+                    if "mediaItem" in result
+                }
+                chunk = [
+                    (creation_time, item_id, fresh_items.get(item_id, item))
+                    for creation_time, item_id, item in chunk
+                ]
+            except Exception as e:
+                print(f"Error refreshing media item URLs: {e}")
+
+        yield from chunk
 
 
 @task(cache_policy=NO_CACHE)
@@ -138,15 +324,20 @@ def download_media_items(
 ) -> dict:
     """
     Download all media items from Google Photos up to a snapshot date.
+    Downloads run concurrently on up to MAX_DOWNLOAD_WORKERS threads sharing
+    one HTTP session.
 
     Args:
         google_photos_credentials: GooglePhotosBlock containing credentials
         snapshot_date: Only download media created before or on this date (UTC)
         local_backup_dir: Base directory for backups
-        max_items: Maximum number of items to download (None for all)
+        max_items: Maximum number of items to download (None for all). Only
+            the newest max_items are considered, so failed downloads are not
+            replaced by older items.
 
     Returns:
-        Dictionary with download statistics
+        Dictionary with download statistics and the path of the items.jsonl
+        file holding per-item metadata
     """
     credentials_path = google_photos_credentials.credentials_path
 
@@ -164,13 +355,16 @@ def download_media_items(
     metadata_file = backup_path / "media_metadata.json"
     if backup_path.exists() and metadata_file.exists():
         print(f"Snapshot for {snapshot_date.isoformat()} already exists, skipping download...")
-        with open(metadata_file, "r") as f:
-            existing_metadata = json.load(f)
+        # The summary is small; per-item metadata stays on disk in items.jsonl.
+        # Snapshots written before items.jsonl embed their items in the summary
+        # itself and have no items_file.
+        existing_metadata = orjson.loads(metadata_file.read_bytes())
+        existing_items_file = existing_metadata.get("items_file")
         return {
             "username": username,
             "item_count": existing_metadata.get("total_items_downloaded", 0),
             "backup_path": str(backup_path),
-            "items": existing_metadata.get("items", []),
+            "items_file": str(backup_path / existing_items_file) if existing_items_file else None,
             "skipped": True,
         }
 
@@ -178,14 +372,19 @@ def download_media_items(
 
     # Download media items
     item_count = 0
-    downloaded_items = []
 
     print(f"Starting download of media items (snapshot date: {snapshot_date.isoformat()})...")
 
     # Collect all media items and sort deterministically
     all_items = []
 
+    # creationTime is RFC 3339 in UTC ("...Z"), so an item whose timestamp is
+    # lexically later than this to the second is after the snapshot and can be
+    # skipped without parsing it
+    snapshot_prefix = snapshot_date.strftime("%Y-%m-%dT%H:%M:%S")
+
     # List all media items using the mediaItems.list endpoint
+    listed_at = time.monotonic()
     page_token = None
     while True:
         try:
@@ -203,6 +402,8 @@ def download_media_items(
             for item in media_items:
                 # Parse creation time
                 creation_time_str = item['mediaMetadata']['creationTime']
+                if creation_time_str.endswith('Z') and creation_time_str[:19] > snapshot_prefix:
+                    continue
                 creation_time = datetime.fromisoformat(creation_time_str.replace('Z', '+00:00'))
 
                 # Ensure UTC timezone
@@ -215,10 +416,15 @@ def download_media_items(
                 if creation_time > snapshot_date:
                     continue
 
-                all_items.append({
-                    "item": item,
-                    "creation_time": creation_time,
-                })
+                # With max_items set, only the newest max_items are kept, in a
+                # min-heap whose root is the oldest item retained so far
+                entry = (creation_time, item['id'], item)
+                if not max_items:
+                    all_items.append(entry)
+                elif len(all_items) < max_items:
+                    heapq.heappush(all_items, entry)
+                else:
+                    heapq.heappushpop(all_items, entry)
 
             # Check if there are more pages
             page_token = results.get('nextPageToken')
@@ -231,98 +437,71 @@ def download_media_items(
 
     # Sort items by creation time and item ID (newest first) for deterministic ordering
     # Using composite key to handle timestamp collisions (e.g., burst mode photos)
-    all_items.sort(key=lambda x: (x["creation_time"], x["item"]["id"]), reverse=True)
-
-    # Download items
-    for item_data in all_items:
-        if max_items and item_count >= max_items:
-            break
-
-        item = item_data["item"]
-        creation_time = item_data["creation_time"]
-
-        try:
-            # Download the media file
-            # Get the base URL and append download parameters
-            base_url = item['baseUrl']
-
-            # Determine if it's a photo or video
-            mime_type = item['mimeType']
-            is_video = mime_type.startswith("video/")
-
-            # Get file extension from mime type
-            if is_video:
-                download_url = f"{base_url}=dv"  # Download video
-                extension = mime_type.split("/")[-1]  # e.g., "mp4" from "video/mp4"
-            else:
-                download_url = f"{base_url}=d"  # Download photo at full resolution
-                extension = mime_type.split("/")[-1]  # e.g., "jpeg" from "image/jpeg"
-
-            # Create filename using item ID and extension
-            filename = f"{item['id']}.{extension}"
-            file_path = backup_path / filename
-
-            # Download the file
-            import requests
-            response = requests.get(download_url)
-            response.raise_for_status()
+    all_items.sort(key=itemgetter(0, 1), reverse=True)
+
+    # Download items concurrently, with at most MAX_DOWNLOAD_WORKERS in flight
+    # and never more than max_items successful + in-flight downloads.
+    pending_items = enumerate(iter_fresh_media_items(service, all_items, listed_at))
+    in_flight = {}
+
+    # Item metadata is appended to a single JSON Lines file in listing order;
+    # results that finish early wait in `finished` until their turn
+    items_file = backup_path / ITEMS_FILENAME
+    finished = {}
+    next_index = 0
+
+    with create_download_session() as session, \
+            ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor, \
+            open(items_file, "wb", buffering=DOWNLOAD_CHUNK_SIZE) as items_out:
+        while True:
+            while len(in_flight) < MAX_DOWNLOAD_WORKERS and (
+                not max_items or item_count + len(in_flight) < max_items
+            ):
+                next_item = next(pending_items, None)
+                if next_item is None:
+                    break
+                index, (creation_time, _, item) = next_item
+                future = executor.submit(
+                    download_media_item,
+                    item,
+                    creation_time,
+                    backup_path,
+                    session,
+                )
+                in_flight[future] = (index, item)
+
+            if not in_flight:
+                break
 
-            with open(file_path, "wb") as f:
-                f.write(response.content)
-
-            # Save metadata for this item
-            media_metadata = item['mediaMetadata']
-            metadata = {
-                "id": item['id'],
-                "filename": item.get('filename', filename),
-                "creation_time": creation_time.isoformat(),
-                "mime_type": mime_type,
-                "is_video": is_video,
-                "width": media_metadata.get('width'),
-                "height": media_metadata.get('height'),
-                "description": item.get("description", ""),
-                "local_path": str(file_path),
-            }
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, item = in_flight.pop(future)
+                try:
+                    metadata = future.result()
+                except Exception as e:
+                    print(f"Error downloading item {item['id']}: {e}")
+                    metadata = None
+                else:
+                    item_count += 1
+                    print(f"Downloaded item {item_count}: {metadata['filename']} ({metadata['mime_type']})")
+                finished[index] = metadata
 
-            # Save photo-specific metadata
-            if 'photo' in media_metadata:
-                photo_metadata = media_metadata['photo']
-                metadata["camera_make"] = photo_metadata.get("cameraMake", "")
-                metadata["camera_model"] = photo_metadata.get("cameraModel", "")
-                metadata["focal_length"] = photo_metadata.get("focalLength", 0.0)
-                metadata["aperture_f_number"] = photo_metadata.get("apertureFNumber", 0.0)
-                metadata["iso_equivalent"] = photo_metadata.get("isoEquivalent", 0)
-
-            # Save video-specific metadata
-            if 'video' in media_metadata:
-                video_metadata = media_metadata['video']
-                metadata["fps"] = video_metadata.get("fps", 0.0)
-                metadata["status"] = video_metadata.get("status", "")
-
-            # Save individual item metadata
-            item_metadata_file = backup_path / f"{item['id']}.json"
-            with open(item_metadata_file, "w") as f:
-                json.dump(metadata, f, indent=2, sort_keys=True)
-
-            downloaded_items.append(metadata)
-            item_count += 1
-            print(f"Downloaded item {item_count}: {item.get('filename', filename)} ({mime_type})")
-
-        except Exception as e:
-            print(f"Error downloading item {item['id']}: {e}")
-            continue
+            while next_index in finished:
+                metadata = finished.pop(next_index)
+                next_index += 1
+                if metadata is not None:
+                    items_out.write(orjson.dumps(metadata, option=orjson.OPT_SORT_KEYS) + b"\n")
 
     # Save summary metadata
     summary_file = backup_path / "media_metadata.json"
-    with open(summary_file, "w") as f:
-        json.dump({
-            "username": username,
-            "total_items_downloaded": item_count,
-            "snapshot_date": snapshot_date.isoformat(),
-            "execution_timestamp": datetime.now(timezone.utc).isoformat(),
-            "workflow_version": "1.0.0",
-            "items": downloaded_items,
-        }, f, indent=2, sort_keys=True)
+    summary_file.write_bytes(orjson.dumps({
+        "username": username,
+        "total_items_downloaded": item_count,
+        "snapshot_date": snapshot_date.isoformat(),
+        "execution_timestamp": datetime.now(timezone.utc).isoformat(),
+        "workflow_version": "2.0.0",
+        "items_file": ITEMS_FILENAME,
+    }, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
 
     print(f"Downloaded {item_count} media items to {backup_path}")
 
@@ -330,7 +509,7 @@ def download_media_items(
         "username": username,
         "item_count": item_count,
         "backup_path": str(backup_path),
-        "items": downloaded_items,
+        "items_file": str(items_file),
     }
 
 
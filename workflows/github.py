@@ -1,113 +1,464 @@
 import asyncio
+import functools
+import logging
+import operator
+import os
+import random
+import re
 import subprocess
 import shutil
+import threading
 import time
-import json
+import uuid
+
+import orjson
+import requests
 
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
+from pprint import pformat
 
 from prefect import flow, task
 from prefect.cache_policies import NO_CACHE
+from prefect.futures import as_completed
 from prefect.logging import get_run_logger
+from prefect.task_runners import ThreadPoolTaskRunner
+from prefect.utilities.hashing import hash_objects
 
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from prefect_github.repository_owner import query_repository_owner_repositories
-from prefect_github.repository import query_repository
 from prefect_github import GitHubCredentials
 
 from blocks.github_block import GitHubBlock
 
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+LOCAL_BACKUP_DIR = Path("./backups/local")
+
+# Absolute path of the git executable, resolved once instead of searched for
+# on PATH by every clone and log
+GIT_BIN = shutil.which("git") or "git"
+
+# Options for git commands that talk to GitHub: protocol v2 lets the server
+# filter refs instead of advertising all of them (already the default on
+# git >= 2.26, set here for older installs)
+GIT_NETWORK_OPTIONS = ("-c", "protocol.version=2")
+
+# Environment for the same commands: a transfer slower than 1 KB/s for 60 s is
+# aborted instead of hanging a worker, so the task fails and is retried, and
+# messages stay in English so transient errors (TRANSIENT_ERROR_MARKERS) are recognized
+GIT_NETWORK_ENV = {
+    "GIT_HTTP_LOW_SPEED_LIMIT": "1000",
+    "GIT_HTTP_LOW_SPEED_TIME": "60",
+    "LC_ALL": "C",
+}
+
+# Repositories are processed concurrently; each one is dominated by git clone
+# network I/O, so threads are enough to overlap them.
+MAX_CONCURRENT_REPOSITORIES = 8
+
+
+REPOSITORIES_QUERY = """
+query ($login: String!, $after: String) {
+  repositoryOwner(login: $login) {
+    repositories(first: 100, after: $after) {
+      pageInfo {
+        hasNextPage
+        endCursor
+      }
+      nodes {
+        name
+        url
+        isPrivate
+        isFork
+        defaultBranchRef {
+          name
+        }
+      }
+    }
+  }
+}
+"""
+
+# Shared selection for a repository's default-branch history, reused by every
+# alias of the batched commit query below.
+COMMIT_HISTORY_FRAGMENT = """
+fragment CommitHistory on Repository {
+  defaultBranchRef {
+    target {
+      ... on Commit {
+        history(first: $first, until: $until) {
+          nodes {
+            oid
+            message
+            committedDate
+            url
+            author {
+              name
+              email
+              date
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
 
-@task(cache_policy=NO_CACHE)
-def get_all_repositories(
+# GitHub rejects GraphQL documents whose node count gets too large, so aliased
+# repository sub-queries are sent in batches of this size.
+GRAPHQL_BATCH_SIZE = 50
+
+# Per-request timeout for GraphQL calls; a hung request fails and is retried
+GITHUB_GRAPHQL_TIMEOUT_SECONDS = 60
+
+
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+
+_http_sessions = threading.local()
+
+
+def _get_http_session() -> requests.Session:
+    """
+    Return this thread's HTTP session, creating it on first use.
+
+    Reusing a session keeps the connection to api.github.com alive between
+    GraphQL requests instead of paying a new TLS handshake for each one.
+    Sessions are per thread because requests.Session isn't guaranteed to be
+    thread-safe and tasks run on a thread pool.
+    """
+    session = getattr(_http_sessions, "session", None)
+    if session is None:
+        session = _http_sessions.session = requests.Session()
+    return session
+
+
+def _execute_graphql(
+    github_credentials: GitHubCredentials,
+    query: str,
+    raise_on_errors: bool = False,
+    **variables,
+) -> dict:
+    """
+    Execute a raw GraphQL document against the GitHub API.
+
+    Requests go through a pooled keep-alive session rather than the
+    credentials' one-shot HTTP endpoint. Raises RuntimeError (like
+    prefect_github does) on HTTP errors or when the response carries no data;
+    the message keeps the status (e.g. "502 Bad Gateway") so transient
+    failures are retried. With raise_on_errors, partial results (data plus
+    an errors list, e.g. one aliased repository NOT_FOUND) raise as well.
+    """
+    response = _get_http_session().post(
+        GITHUB_GRAPHQL_URL,
+        data=orjson.dumps({"query": query, "variables": variables}),
+        headers={
+            "Authorization": f"Bearer {github_credentials.token.get_secret_value()}",
+            "Content-Type": "application/json",
+        },
+        timeout=GITHUB_GRAPHQL_TIMEOUT_SECONDS,
+    )
+    if not response.ok:
+        raise RuntimeError(
+            f"Error encountered:\nHTTP Error {response.status_code}: {response.reason}"
+        )
+
+    result = orjson.loads(response.content)
+    if result.get("data") is None or (raise_on_errors and result.get("errors")):
+        errors = pformat(result.get("errors"))
+        raise RuntimeError(f"Error encountered:\n{errors}")
+    return result["data"]
+
+
+@functools.lru_cache(maxsize=None)
+def _build_commit_history_query(repo_count: int) -> str:
+    """
+    Build one GraphQL document with an aliased repository sub-query per repo.
+
+    Only the batch size varies between calls (repository names are passed as
+    variables), so each document is built once per process and reused.
+    """
+    name_variables = ", ".join(f"$name{i}: String!" for i in range(repo_count))
+    aliases = "\n".join(
+        f"  repo{i}: repository(owner: $owner, name: $name{i}) {{ ...CommitHistory }}"
+        for i in range(repo_count)
+    )
+    return (
+        f"query ($owner: String!, $first: Int!, $until: GitTimestamp, {name_variables}) "
+        f"{{\n{aliases}\n}}\n"
+        f"{COMMIT_HISTORY_FRAGMENT}"
+    )
+
+
+def _parse_commit_history(repository: dict) -> list[dict]:
+    """
+    Extract commit dictionaries from a repository's CommitHistory selection.
+    """
+    commits = []
+
+    # Structure: repository -> defaultBranchRef -> target -> history -> nodes
+    default_branch_ref = (repository or {}).get("defaultBranchRef")
+    if not default_branch_ref:
+        return commits
+
+    target = default_branch_ref.get("target") or {}
+    history = target.get("history") or {}
+
+    for node in history.get("nodes") or []:
+        if not node:
+            continue
+
+        author = node.get("author") or {}
+        commits.append({
+            "sha": node.get("oid", ""),
+            "message": node.get("message", ""),
+            "author_name": author.get("name", ""),
+            "author_email": author.get("email", ""),
+            "date": node.get("committedDate") or author.get("date", ""),
+            "url": node.get("url", ""),
+        })
+
+    return commits
+
+
+def _to_utc(value: datetime) -> datetime:
+    """
+    Return a timezone-aware UTC datetime; naive values are assumed to be UTC.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _fetch_commit_histories(
     owner: str,
-    github_credentials: GitHubCredentials
-) -> list[dict]:
+    repo_names: list[str],
+    github_credentials: GitHubCredentials,
+    until_date: datetime = None,
+    max_commits: int = 100,
+) -> dict[str, list[dict]]:
     """
-    Get all repositories for a given owner with necessary fields for cloning.
-    Returns repositories sorted by name for deterministic ordering.
+    Fetch default-branch commit histories for many repositories, one GraphQL
+    request per GRAPHQL_BATCH_SIZE repositories.
+
+    until_date is applied server-side (history(until:)), so every returned
+    commit is at or before it and no Python-side date filtering is needed.
     """
-    logger = get_run_logger()
+    commits_by_repo = {}
+    until = _to_utc(until_date).isoformat() if until_date else None
+
+    for batch_start in range(0, len(repo_names), GRAPHQL_BATCH_SIZE):
+        batch = repo_names[batch_start:batch_start + GRAPHQL_BATCH_SIZE]
+        variables = {f"name{i}": name for i, name in enumerate(batch)}
+        # A failed alias comes back as null plus an error; raise rather than
+        # parse it as an empty history, which would then be cached
+        data = _execute_graphql(
+            github_credentials,
+            _build_commit_history_query(len(batch)),
+            raise_on_errors=True,
+            owner=owner,
+            first=max_commits,
+            until=until,
+            **variables,
+        )
+        for i, name in enumerate(batch):
+            commits_by_repo[name] = _parse_commit_history(data.get(f"repo{i}"))
 
-    # Query repositories - specify fields we want on each repository node
-    # The library will automatically include nodes when we specify return_fields
-    # Note: We don't include "owner" because it causes issues with nested repository queries
-    # Note: query_repository_owner_repositories is async, so we use asyncio.run()
-    # Add retry logic for transient API errors (like 502 Bad Gateway)
-    max_retries = 3
-    retry_delay = 2  # seconds
+    return commits_by_repo
 
-    for attempt in range(max_retries):
-        try:
-            # NOTE: is_fork field causes issues with prefect_github library
-            # We'll check fork status another way after fetching the repos
-            repositories = asyncio.run(
-                query_repository_owner_repositories(
-                    login=owner,
-                    github_credentials=github_credentials,
-                    first=100,  # Get up to 100 repositories per page
-                    return_fields=["name", "url", "is_private"]
+
+def _iter_repository_nodes(owner: str, github_credentials: GitHubCredentials):
+    """
+    Yield repository nodes for an owner, following the connection cursor
+    until GitHub reports no further pages.
+
+    Transient errors are retried per page, with the same jittered backoff as
+    GITHUB_RETRY_OPTIONS, so a 502 on page 5 doesn't refetch pages 1-4. This
+    is the only retry layer for the listing: get_all_repositories has no task
+    retries, which would restart it from the first page.
+    """
+    # Query repositories with a raw GraphQL document
+    # Note: We don't include "owner" because we're already querying by owner
+    cursor = None
+
+    jitter = GITHUB_RETRY_OPTIONS["retry_jitter_factor"]
+
+    while True:
+        for retry_delay in (*GITHUB_RETRY_OPTIONS["retry_delay_seconds"], None):
+            try:
+                data = _execute_graphql(
+                    github_credentials, REPOSITORIES_QUERY, login=owner, after=cursor
                 )
-            )
-            # Success, exit retry loop
-            break
-        except RuntimeError as e:
-            error_msg = str(e)
-            # Check if it's a 502 or other transient error
-            if "502" in error_msg or "Bad Gateway" in error_msg:
-                if attempt < max_retries - 1:
-                    logger.warning(f"GitHub API returned 502 error, retrying in {retry_delay} seconds (attempt {attempt + 1}/{max_retries})...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                    continue
-                else:
-                    logger.error(f"GitHub API error after {max_retries} attempts: {error_msg}")
+                break
+            except (RuntimeError, requests.RequestException) as e:
+                if retry_delay is None or not _is_transient_github_error(e):
                     raise
-            else:
-                # Not a transient error, re-raise immediately
-                raise
+                retry_delay *= random.uniform(1 - jitter, 1 + jitter)
+                get_run_logger().warning(
+                    "GitHub API error listing repositories, retrying page in %.1f seconds: %s",
+                    retry_delay, e,
+                )
+                time.sleep(retry_delay)
+        repositories = (data.get("repositoryOwner") or {}).get("repositories") or {}
 
-    # Extract repository information
-    repo_list = []
-    repos_data = repositories.get("nodes", [])
+        yield from repositories.get("nodes") or []
 
-    for repo in repos_data:
-        repo_url = repo.get("url", "")
-        # Ensure clone_url ends with .git
-        clone_url = repo_url if repo_url.endswith(".git") else f"{repo_url}.git"
+        page_info = repositories.get("pageInfo") or {}
+        if not page_info.get("hasNextPage"):
+            break
+        cursor = page_info.get("endCursor")
 
-        # Default branch - we don't query it to avoid permission issues
-        # Most repos use "main" or "master", default to "main"
-        default_branch = "main"
 
-        # Use the owner parameter we already have (since we're querying by owner)
-        owner_login = owner
+@functools.lru_cache(maxsize=1)
+def _load_github_credentials(block_name: str) -> GitHubCredentials:
+    """
+    Load the GitHub block and wrap its token in GitHubCredentials.
+
+    Cached so that repeated flow runs in one process (e.g. a served
+    deployment) hit the Prefect blocks API once; restart the process to pick
+    up a rotated token.
+    """
+    github_block = GitHubBlock.load(block_name)
+    return GitHubCredentials(token=github_block.token)
 
-        # Note: is_fork field removed from query due to library bug
-        # Will be detected later by checking repository description/metadata
-        repo_list.append({
+
+# Substrings of GraphQL/git error messages that mark a retryable failure;
+# the last two are how git reports a transfer aborted by GIT_NETWORK_ENV's
+# low-speed limit ("RPC failed; curl 28 Operation too slow ... early EOF")
+TRANSIENT_ERROR_MARKERS = (
+    "502", "Bad Gateway",
+    "503", "Service Unavailable",
+    "504", "Gateway Timeout",
+    "curl 28", "early EOF",
+)
+
+
+def _is_transient_github_error(error: Exception) -> bool:
+    """
+    Whether an error looks like a transient GitHub failure (a timeout, a
+    dropped connection, a 502/503/504 or a stalled git transfer), either from
+    the GraphQL API or from git talking to github.com.
+    """
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True
+    message = f"{error} {getattr(error, 'stderr', None) or ''}"
+    return any(marker in message for marker in TRANSIENT_ERROR_MARKERS)
+
+
+def _retry_on_transient_github_error(task, task_run, state) -> bool:
+    """
+    Prefect retry condition: only retry task runs that failed transiently.
+
+    _sync=True is required: for async tasks state.result() would otherwise
+    return an un-awaited coroutine instead of the exception.
+    """
+    error = state.result(raise_on_failure=False, _sync=True)
+    return isinstance(error, Exception) and _is_transient_github_error(error)
+
+
+# Retry transient GitHub failures with exponential backoff; jitter keeps the
+# concurrently running repository tasks from retrying in lockstep.
+GITHUB_RETRY_OPTIONS = {
+    "retries": 3,
+    "retry_delay_seconds": [2, 4, 8],
+    "retry_jitter_factor": 0.3,
+    "retry_condition_fn": _retry_on_transient_github_error,
+}
+
+
+def _clone_url(repo_url: str) -> str:
+    """
+    Return the HTTPS clone URL for a repository URL (with a .git suffix).
+    """
+    return repo_url if repo_url.endswith(".git") else f"{repo_url}.git"
+
+
+# No task retries: _iter_repository_nodes retries each page in place
+@task(cache_policy=NO_CACHE, tags=["github-api"])
+def get_all_repositories(
+    owner: str,
+    github_credentials: GitHubCredentials
+) -> list[dict]:
+    """
+    Get all repositories for a given owner with necessary fields for cloning.
+    Pages through the owner's repositories 100 at a time, so owners with more
+    than 100 repositories are listed completely.
+    Returns repositories sorted by name for deterministic ordering.
+    """
+    logger = get_run_logger()
+
+    # Extract repository information in a single pass. Fork status and the
+    # default branch come with the listing, so no per-repository lookups are
+    # needed; empty repositories have no default branch, so fall back to "main".
+    repo_list = [
+        {
             "name": repo.get("name"),
-            "url": repo_url,
-            "clone_url": clone_url,
-            "is_private": repo.get("is_private", False),
-            "is_fork": False,  # Will be updated after cloning if needed
-            "default_branch": default_branch,
-            "owner": owner_login
-        })
+            "url": repo.get("url", ""),
+            # Ensure clone_url ends with .git
+            "clone_url": _clone_url(repo.get("url", "")),
+            "is_private": repo.get("isPrivate", False),
+            "is_fork": repo.get("isFork", False),
+            "default_branch": (repo.get("defaultBranchRef") or {}).get("name") or "main",
+            "owner": owner,
+        }
+        for repo in _iter_repository_nodes(owner, github_credentials)
+    ]
 
     # Sort repositories by name for deterministic ordering
-    repo_list.sort(key=lambda r: r["name"])
+    repo_list.sort(key=operator.itemgetter("name"))
 
-    logger.info(f"Found {len(repo_list)} repositories for {owner}")
-    logger.info(f"Repositories: {[repo['name'] for repo in repo_list]}")
+    logger.info("Found %d repositories for %s", len(repo_list), owner)
+    # Only build the name list when debug logging is actually enabled
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Repositories: %s", ", ".join(repo["name"] for repo in repo_list))
 
     return repo_list
 
 
-@task()
+def _commit_history_cache_key(context, parameters: dict) -> str | None:
+    """
+    Prefect cache key for commit history tasks.
+
+    A history cut off at a fixed until_date never changes, so results are
+    keyed on what was asked for (owner, repositories, until_date, max_commits)
+    and never on the credentials. Without an until_date the result depends on
+    when the task runs, so it is not cached.
+
+    The key is also the result file name, so the parts are hashed rather than
+    embedded (a batch of repository names would exceed the file name limit).
+    """
+    until_date = parameters.get("until_date")
+    if until_date is None:
+        return None
+    repo_names = parameters.get("repo_names") or [parameters.get("repo_name")]
+    return "github-commits-{}".format(hash_objects(
+        parameters["owner"],
+        list(repo_names),
+        _to_utc(until_date).isoformat(),
+        parameters.get("max_commits", 100),
+    ))
+
+
+# Commit histories for a fixed snapshot date are immutable, so repeated runs
+# for the same snapshot reuse the stored result instead of querying GitHub
+COMMIT_HISTORY_CACHE_OPTIONS = {
+    "cache_key_fn": _commit_history_cache_key,
+    "cache_expiration": timedelta(days=1),
+}
+
+
+@task(tags=["github-api"], **COMMIT_HISTORY_CACHE_OPTIONS, **GITHUB_RETRY_OPTIONS)
 def get_repository_commits(
     owner: str,
     repo_name: str,
@@ -118,8 +469,8 @@ def get_repository_commits(
     """
     Get commits for a repository up until a specific date using GitHub GraphQL API.
 
-    Uses the Prefect GitHub integration's query_repository function to fetch
-    commit history from the repository's default branch.
+    Sends the same aliased history query as get_repository_commits_batch with a
+    single repository, reading commit history from the default branch.
 
     Args:
         owner: The repository owner (username or organization)
@@ -131,132 +482,236 @@ def get_repository_commits(
     Returns:
         List of commit dictionaries with keys: sha, message, author_name,
         author_email, date, url
+
+    Raises:
+        RuntimeError: If the GraphQL request fails. Errors are not turned into
+            an empty history, since a completed result would be cached for
+            the snapshot; transient ones are retried first.
     """
-    try:
-        # Query repository with default branch ref and commit history
-        # The return_fields format follows GitHub GraphQL API field names in snake_case
-        # Note: query_repository is async, so we use asyncio.run()
-        result = asyncio.run(
-            query_repository(
-                owner=owner,
-                name=repo_name,
-                github_credentials=github_credentials,
-                return_fields=[
-                    "default_branch_ref",
-                    "default_branch_ref.target",
-                    "default_branch_ref.target.history",
-                ]
+    commits_by_repo = _fetch_commit_histories(
+        owner, [repo_name], github_credentials, until_date, max_commits
+    )
+    return commits_by_repo.get(repo_name, [])
+
+
+@task(tags=["github-api"], **COMMIT_HISTORY_CACHE_OPTIONS, **GITHUB_RETRY_OPTIONS)
+def get_repository_commits_batch(
+    owner: str,
+    repo_names: list[str],
+    github_credentials: GitHubCredentials,
+    until_date: datetime = None,
+    max_commits: int = 100
+) -> dict[str, list[dict]]:
+    """
+    Get commits for many repositories of one owner in as few GraphQL requests
+    as possible.
+
+    Each request carries up to GRAPHQL_BATCH_SIZE aliased repository
+    sub-queries, so M repositories cost ceil(M / GRAPHQL_BATCH_SIZE) round-trips
+    instead of M.
+
+    Args:
+        owner: The repository owner (username or organization)
+        repo_names: The repository names
+        github_credentials: GitHub credentials for authentication
+        until_date: Optional datetime to filter commits up to this date
+        max_commits: Maximum number of commits to retrieve per repository (default: 100)
+
+    Returns:
+        Dictionary mapping repository name to its list of commit dictionaries
+        (same keys as get_repository_commits)
+
+    Raises:
+        RuntimeError: If a GraphQL request fails (see get_repository_commits).
+    """
+    return _fetch_commit_histories(
+        owner, repo_names, github_credentials, until_date, max_commits
+    )
+
+
+async def _run_git(*args: str, env: dict = None) -> None:
+    """
+    Run a git command without blocking the event loop, raising
+    CalledProcessError (with stderr) on a non-zero exit like subprocess.run.
+
+    env holds variables to set on top of the current environment.
+    """
+    argv = [GIT_BIN, *args]
+    proc = await asyncio.create_subprocess_exec(
+        *argv,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        env={**os.environ, **env} if env else None,
+    )
+    _, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(
+            proc.returncode, argv, stderr=stderr.decode("utf-8", errors="replace")
+        )
+
+
+async def _update_mirror(
+    clone_url: str,
+    mirror_path: Path,
+    default_branch: str = None,
+    partial: bool = False,
+) -> bool:
+    """
+    Bring the persistent bare mirror of a repository up to date.
+
+    The first run creates it with git clone --mirror; later runs only fetch
+    what changed since the previous run and re-point HEAD at default_branch,
+    since fetching never moves it (e.g. after a master -> main rename).
+    Returns True when the mirror was freshly created.
+
+    With partial=True a new mirror is created with --filter=blob:none, so only
+    commits and trees are downloaded. git records the filter in the mirror's
+    config and keeps applying it on later fetches. A blobless mirror updated
+    with partial=False is turned back into a full one by refetching every
+    object (git >= 2.36), so the requested mode is honored.
+    """
+    if (mirror_path / "HEAD").exists():
+        # Re-point origin in case the token embedded in the URL has rotated
+        await _run_git("-C", str(mirror_path), "remote", "set-url", "origin", clone_url)
+        if not partial and _is_partial_mirror(mirror_path):
+            # Drop the filter and fetch everything again, blobs included, as a
+            # fresh clone would. origin stays a promisor until the refetch
+            # succeeds, so a failed fetch is retried on the next run.
+            try:
+                await _run_git("-C", str(mirror_path), "config", "--unset-all", "remote.origin.partialclonefilter")
+            except subprocess.CalledProcessError as e:
+                # 5: already unset by an earlier attempt whose refetch failed
+                if e.returncode != 5:
+                    raise
+            await _run_git(
+                *GIT_NETWORK_OPTIONS, "-C", str(mirror_path), "fetch", "--refetch", "--prune", "origin",
+                env=GIT_NETWORK_ENV,
+            )
+            await _run_git("-C", str(mirror_path), "config", "--unset", "remote.origin.promisor")
+        else:
+            await _run_git(
+                *GIT_NETWORK_OPTIONS, "-C", str(mirror_path), "remote", "update", "--prune",
+                env=GIT_NETWORK_ENV,
+            )
+        if default_branch:
+            await _run_git(
+                "-C", str(mirror_path), "symbolic-ref", "HEAD", f"refs/heads/{default_branch}"
             )
+        return False
+
+    if partial:
+        await _run_git(
+            *GIT_NETWORK_OPTIONS, "clone", "--mirror", "--filter=blob:none",
+            clone_url, str(mirror_path),
+            env=GIT_NETWORK_ENV,
+        )
+    else:
+        await _run_git(
+            *GIT_NETWORK_OPTIONS, "clone", "--mirror", clone_url, str(mirror_path),
+            env=GIT_NETWORK_ENV,
         )
+    return True
 
-        commits = []
-
-        # Extract commits from the GraphQL response
-        # Structure: repository -> default_branch_ref -> target -> history -> edges -> node
-        default_branch_ref = result.get("default_branch_ref")
-        if not default_branch_ref:
-            return commits
-
-        target = default_branch_ref.get("target", {})
-        if not target:
-            return commits
-
-        history = target.get("history", {})
-        edges = history.get("edges", [])
-
-        for edge in edges:
-            node = edge.get("node", {})
-            if not node:
-                continue
-
-            # Extract commit information
-            commit_date_str = node.get("committed_date") or node.get("author", {}).get("date", "")
-
-            # Parse commit date if available
-            commit_date = None
-            if commit_date_str:
-                try:
-                    # GitHub returns ISO 8601 format dates (e.g., "2024-01-01T00:00:00Z")
-                    commit_date = datetime.fromisoformat(commit_date_str.replace("Z", "+00:00"))
-                except (ValueError, AttributeError):
-                    pass
-
-            # Filter by until_date if provided
-            if until_date and commit_date:
-                # Ensure both dates are timezone-aware for comparison
-                if until_date.tzinfo is None:
-                    until_date = until_date.replace(tzinfo=timezone.utc)
-                if commit_date.tzinfo is None:
-                    commit_date = commit_date.replace(tzinfo=timezone.utc)
-
-                # Skip commits after until_date
-                if commit_date > until_date:
-                    continue
-
-            author = node.get("author", {})
-            commits.append({
-                "sha": node.get("oid", ""),
-                "message": node.get("message", ""),
-                "author_name": author.get("name", ""),
-                "author_email": author.get("email", ""),
-                "date": commit_date_str,
-                "url": node.get("url", ""),
-            })
-
-            # Limit number of commits
-            if len(commits) >= max_commits:
-                break
 
-        return commits
+def _is_partial_mirror(mirror_path: Path) -> bool:
+    """
+    Whether a mirror was created as a partial clone (its origin is a promisor
+    remote, so blobs are missing).
+    """
+    try:
+        config = (mirror_path / "config").read_text()
+    except FileNotFoundError:
+        return False
+    return "promisor = true" in config
 
-    except Exception as e:
-        # Log error and return empty list
-        logger = get_run_logger()
-        logger.error(f"Error fetching commits for {owner}/{repo_name}: {e}")
-        return []
 
+def _discard_directory(path: Path) -> bool:
+    """
+    Move a directory aside with a single rename and delete it in the
+    background, so the path can be reused immediately instead of waiting for
+    every file to be unlinked.
+
+    Deletion is done by rm -rf, started with posix_spawn (no fork of this
+    process), which walks the tree in C instead of one Python call per file;
+    a daemon thread only waits to reap it. Platforms without posix_spawn fall
+    back to shutil.rmtree on that thread.
 
-@task(cache_policy=NO_CACHE)
-def clone_repository_to_local(
+    The rename doubles as the existence check: returns False, without
+    touching anything, when there is no directory at path.
+    """
+    stale_path = path.with_name(f".{path.name}.stale-{uuid.uuid4().hex}")
+    try:
+        os.rename(path, stale_path)
+    except FileNotFoundError:
+        return False
+
+    if hasattr(os, "posix_spawnp"):
+        pid = os.posix_spawnp("rm", ["rm", "-rf", "--", str(stale_path)], os.environ)
+        threading.Thread(target=os.waitpid, args=(pid, 0), daemon=True).start()
+        return True
+
+    threading.Thread(
+        target=shutil.rmtree,
+        args=(stale_path,),
+        kwargs={"ignore_errors": True},
+        daemon=True,
+    ).start()
+    return True
+
+
+# Snapshot subdirectory indexed by (is_fork << 1) | is_private: forks take
+# priority, then private/public
+_CATEGORY = ("public", "private", "forks", "forks")
+
+
+def _repository_category(repo_info: dict) -> str:
+    """
+    Return the snapshot subdirectory (forks, private or public) of a repository.
+    """
+    return _CATEGORY[
+        (bool(repo_info.get("is_fork", False)) << 1) | bool(repo_info.get("is_private", False))
+    ]
+
+
+@task(cache_policy=NO_CACHE, tags=["git-clone"], **GITHUB_RETRY_OPTIONS)
+async def clone_repository_to_local(
     repo_info: dict,
-    github_credentials: GitHubCredentials,
-    snapshot_date: datetime,
-    local_backup_dir: Path = Path("./backups/local")
+    github_token: str,
+    snapshot_root: Path,
+    mirrors_dir: Path,
+    partial_clone: bool = False
 ) -> Path:
     """
-    Clone a repository to the local filesystem with full history.
-    Uses timestamped directory structure for non-destructive backups.
-    Organizes repos into subdirectories: forks/, private/, or public/
-    Note: Removes --depth 1 to enable commit history queries.
+    Clone a repository into the snapshot as a bare repository with full
+    history, fetching through the owner's persistent mirror (see README).
+
+    Args:
+        repo_info: Repository information dictionary
+        github_token: GitHub token, used in the clone URL of private repositories
+        snapshot_root: Directory of this snapshot (github/<owner>/repositories/<date>);
+            the clone goes to <forks|private|public>/<name> under it
+        mirrors_dir: Directory of the owner's persistent mirrors
+        partial_clone: Clone without file contents (--filter=blob:none)
+
+    Returns:
+        Path of the snapshot clone
     """
     logger = get_run_logger()
-    local_backup_dir.mkdir(parents=True, exist_ok=True)
 
-    # Determine category: forks take priority, then private/public
-    if repo_info.get("is_fork", False):
-        category = "forks"
-    elif repo_info.get("is_private", False):
-        category = "private"
-    else:
-        category = "public"
+    category = _repository_category(repo_info)
+    repo_path = snapshot_root / category / repo_info["name"]
 
-    # NEW: Timestamped directory structure with platform prefix
-    snapshot_str = snapshot_date.strftime("%Y-%m-%d")
-    repo_path = (
-        local_backup_dir
-        / "github"  # Platform prefix
-        / repo_info["owner"]
-        / "repositories"  # Content type
-        / snapshot_str  # Snapshot date
-        / category
-        / repo_info["name"]
-    )
-
-    # Check if this snapshot already exists (idempotency)
-    if repo_path.exists():
-        logger.info(f"Repository {repo_info['name']} already backed up for snapshot {snapshot_str}, skipping clone...")
+    # Check if this snapshot already exists (idempotency). process_repository
+    # writes backup_metadata.json last, so it marks a complete snapshot.
+    if (repo_path / "backup_metadata.json").exists():
+        logger.info("Repository %s already backed up for snapshot %s, skipping clone...", repo_info["name"], snapshot_root.name)
         return repo_path
 
+    # Anything else at the path is left over from an interrupted or failed
+    # attempt (e.g. a partial clone or only ERROR.json); replace it
+    if _discard_directory(repo_path):
+        logger.info("Discarded incomplete snapshot of %s at %s", repo_info["name"], repo_path)
+
     # Create parent directories
     repo_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -265,76 +720,160 @@ def clone_repository_to_local(
 
     # If private repo, use token in URL
     if repo_info["is_private"]:
-        token = github_credentials.token.get_secret_value()
         # Format: https://token@github.com/owner/repo.git
-        clone_url = clone_url.replace("https://", f"https://{token}@")
+        clone_url = clone_url.replace("https://", f"https://{github_token}@")
+
+    mirror_path = mirrors_dir / f"{repo_info['name']}.git"
+
+    if not partial_clone and _is_partial_mirror(mirror_path):
+        logger.warning(
+            "Mirror of %s is blobless but partial_clone is off; refetching file contents",
+            repo_info["name"],
+        )
 
     try:
-        # FIXED: Removed --depth 1 to enable full commit history queries
-        subprocess.run(
-            ["git", "clone", clone_url, str(repo_path)],
-            check=True,
-            capture_output=True,
-            text=True
+        # Full history (no --depth 1) is required for commit history queries
+        created = await _update_mirror(
+            clone_url, mirror_path, repo_info.get("default_branch"), partial=partial_clone
         )
-        logger.info(f"Successfully cloned {repo_info['name']} to {repo_path}")
+        logger.info("%s mirror for %s at %s", "Created" if created else "Updated", repo_info["name"], mirror_path)
     except subprocess.CalledProcessError as e:
-        logger.error(f"Error cloning {repo_info['name']}: {e.stderr}")
+        logger.error("Error cloning %s: %s", repo_info["name"], e.stderr)
         raise
 
+    # Materialize the snapshot from the local mirror; nothing crosses the network here
+    # libgit2 cannot read a blobless (promisor) mirror, so partial clones always use git
+    if pygit2 is not None and not partial_clone:
+        # In-process clone avoids a git fork/exec per repository
+        try:
+            await asyncio.to_thread(
+                pygit2.clone_repository, str(mirror_path), str(repo_path), bare=True
+            )
+        except pygit2.GitError as e:
+            logger.error("Error cloning %s from mirror: %s", repo_info["name"], e)
+            raise
+    else:
+        try:
+            if partial_clone:
+                # A --local copy of a promisor mirror would lack the promisor
+                # config and be corrupt (missing blobs); a filtered clone over
+                # the git transport records it. Both the mirror and the
+                # snapshot must allow filters for it (and later clones) to work.
+                await _run_git("-C", str(mirror_path), "config", "uploadpack.allowFilter", "true")
+                await _run_git(
+                    "clone", "--bare", "--no-local", "--filter=blob:none",
+                    "--config", "uploadpack.allowFilter=true",
+                    str(mirror_path), str(repo_path),
+                )
+            else:
+                await _run_git("clone", "--bare", "--local", str(mirror_path), str(repo_path))
+        except subprocess.CalledProcessError as e:
+            logger.error("Error cloning %s from mirror: %s", repo_info["name"], e.stderr)
+            raise
+
+    logger.info("Successfully cloned %s to %s", repo_info["name"], repo_path)
     return repo_path
 
 
+# One commit of `git log -z --pretty=tformat:%H%x00%an%x00%ae%x00%ad%x00%s`:
+# five NUL-terminated fields, starting with the (SHA-1 or SHA-256) hash
+COMMIT_RECORD_PATTERN = re.compile(
+    rb"([0-9a-f]{40,64})\x00([^\x00]*)\x00([^\x00]*)\x00([^\x00]*)\x00([^\x00]*)\x00"
+)
+
+
+def _iter_commit_records(stream, chunk_size: int = 64 * 1024):
+    """
+    Yield each commit's five raw fields from a binary git log stream.
+
+    The stream is read in fixed-size chunks so memory stays bounded by the
+    chunk rather than the whole output; each chunk is matched with
+    COMMIT_RECORD_PATTERN in C, and the incomplete record at its end is
+    carried over to the next chunk.
+    """
+    pending = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer = pending + chunk
+        end = 0
+        for match in COMMIT_RECORD_PATTERN.finditer(buffer):
+            yield match.groups()
+            end = match.end()
+        pending = buffer[end:]
+
+
+def _git_date_args(until_date: datetime = None, since_date: datetime = None) -> list[str]:
+    """
+    Build git --until/--since arguments for optional date boundaries.
+    """
+    args = []
+    # Use full UTC timestamps with explicit time for precise boundaries
+    if until_date:
+        args.append(f"--until={_to_utc(until_date).strftime('%Y-%m-%d %H:%M:%S')} +0000")
+    if since_date:
+        args.append(f"--since={_to_utc(since_date).strftime('%Y-%m-%d %H:%M:%S')} +0000")
+    return args
+
+
+# Columns of the commit table returned by get_commits_from_local_repo, in the
+# order git log emits them
+COMMIT_COLUMNS = ("hash", "author_name", "author_email", "date", "message")
+
+
 @task()
 def get_commits_from_local_repo(
     repo_path: Path,
-    until_date: datetime = None
-) -> list[dict]:
+    until_date: datetime = None,
+    max_commits: int = None,
+    since_date: datetime = None
+) -> dict[str, list[str]]:
     """
     Get commits from a locally cloned repository using git log.
     Uses full ISO timestamp format for precise date filtering.
+
+    Output is streamed with NUL-separated fields (git log -z), so commit
+    messages containing "|" parse correctly and the full log is never held in
+    memory as one string.
+
+    Commits are returned column-wise (one list per field) rather than as a
+    dict per commit, which keeps large histories compact; use _commit_rows to
+    turn a slice of them back into dictionaries.
+
+    Args:
+        repo_path: Path to the cloned repository
+        until_date: Optional datetime to filter commits up to this date
+        max_commits: Optional cap on the number of commits read (git --max-count)
+        since_date: Optional datetime to filter commits from this date onwards
+
+    Returns:
+        Dictionary mapping each of COMMIT_COLUMNS (hash, author_name,
+        author_email, date, message) to a list with one entry per commit
     """
+    # Snapshots are bare, so point git straight at the repository instead of
+    # letting it discover one from a working directory
+    argv = [GIT_BIN, "--git-dir", str(repo_path), "log", "-z",
+            "--pretty=tformat:%H%x00%an%x00%ae%x00%ad%x00%s", "--date=iso-strict"]
+
+    argv.extend(_git_date_args(until_date, since_date))
+
+    if max_commits:
+        argv.append(f"--max-count={max_commits}")
+
     try:
-        if until_date:
-            # Ensure until_date is UTC-aware
-            if until_date.tzinfo is None:
-                until_date = until_date.replace(tzinfo=timezone.utc)
-            elif until_date.tzinfo != timezone.utc:
-                # Convert to UTC if it's in a different timezone
-                until_date = until_date.astimezone(timezone.utc)
-
-            # FIXED: Use full timestamp format with explicit time for precise boundary
-            date_str = until_date.strftime("%Y-%m-%d %H:%M:%S")
-            result = subprocess.run(
-                ["git", "-C", str(repo_path), "log", f"--until={date_str}",
-                 "--pretty=format:%H|%an|%ae|%ad|%s", "--date=iso-strict"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-        else:
-            result = subprocess.run(
-                ["git", "-C", str(repo_path), "log",
-                 "--pretty=format:%H|%an|%ae|%ad|%s", "--date=iso-strict"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+        columns = {name: [] for name in COMMIT_COLUMNS}
+        appends = [columns[name].append for name in COMMIT_COLUMNS]
+        with subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+            for record in _iter_commit_records(proc.stdout):
+                for append, field in zip(appends, record):
+                    append(field.decode("utf-8", errors="replace"))
+            stderr = proc.stderr.read().decode("utf-8", errors="replace")
 
-        commits = []
-        for line in result.stdout.strip().split("\n"):
-            if line:
-                parts = line.split("|", 4)
-                if len(parts) == 5:
-                    commits.append({
-                        "hash": parts[0],
-                        "author_name": parts[1],
-                        "author_email": parts[2],
-                        "date": parts[3],
-                        "message": parts[4]
-                    })
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, argv, stderr=stderr)
 
-        return commits
+        return columns
 
     except subprocess.CalledProcessError as e:
         # Provide detailed error information for git failures
@@ -342,10 +881,71 @@ def get_commits_from_local_repo(
         error_msg = f"git log failed with exit code {e.returncode}"
         if e.stderr:
             error_msg += f": {e.stderr.strip()}"
-        logger.error(f"Error getting commits from {repo_path}: {error_msg}")
+        logger.error("Error getting commits from %s: %s", repo_path, error_msg)
         raise RuntimeError(error_msg) from e
 
 
+@task()
+def get_commit_summary(
+    repo_path: Path,
+    until_date: datetime = None,
+    sample_size: int = 10
+) -> dict:
+    """
+    Count a local repository's commits and read only the newest few.
+
+    git rev-list --count does the counting in C, and git log stops after
+    sample_size commits, so nothing proportional to the history length is
+    parsed in Python.
+
+    Args:
+        repo_path: Path to the cloned repository
+        until_date: Optional datetime to filter commits up to this date
+        sample_size: Number of newest commits to return (default: 10)
+
+    Returns:
+        Dictionary with commit_count and commits_sample (a list of commit
+        dictionaries with the keys of COMMIT_COLUMNS)
+    """
+    argv = [GIT_BIN, "--git-dir", str(repo_path), "rev-list", "--count",
+            *_git_date_args(until_date), "HEAD"]
+
+    try:
+        result = subprocess.run(argv, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        logger = get_run_logger()
+        error_msg = f"git rev-list failed with exit code {e.returncode}"
+        if e.stderr:
+            error_msg += f": {e.stderr.strip()}"
+        logger.error("Error counting commits in %s: %s", repo_path, error_msg)
+        raise RuntimeError(error_msg) from e
+
+    sample = get_commits_from_local_repo(repo_path, until_date, sample_size)
+    return {
+        "commit_count": int(result.stdout),
+        "commits_sample": _commit_rows(sample),
+    }
+
+
+def _commit_rows(columns: dict[str, list[str]], limit: int = None) -> list[dict]:
+    """
+    Turn the first `limit` commits of a column-wise commit table into
+    per-commit dictionaries (all of them when limit is None).
+    """
+    return [
+        dict(zip(COMMIT_COLUMNS, row))
+        for row in zip(*(columns[name][:limit] for name in COMMIT_COLUMNS))
+    ]
+
+
+def _write_commits_parquet(columns: dict[str, list[str]], path: Path) -> None:
+    """
+    Write a column-wise commit table to a zstd-compressed Parquet file.
+    """
+    table = pyarrow.table({name: columns[name] for name in COMMIT_COLUMNS})
+    pyarrow.parquet.write_table(table, path, compression="zstd")
+
+
 # @task()
 # def backup_to_remote_filesystem(
 #     local_repo_path: Path,
@@ -372,99 +972,163 @@ def get_commits_from_local_repo(
 #     return remote_repo_path
 
 
+def _read_default_branch(repo_path: Path) -> str | None:
+    """
+    Return the branch a bare clone's HEAD points to (the remote's default
+    branch at clone time), or None if HEAD is missing or detached.
+
+    Reads the HEAD file directly instead of running git symbolic-ref.
+    """
+    try:
+        head = (repo_path / "HEAD").read_text().strip()
+    except OSError:
+        return None
+    prefix = "ref: refs/heads/"
+    return head[len(prefix):] if head.startswith(prefix) else None
+
+
+def _load_backup_metadata(repo_path: Path, snapshot_date: datetime) -> dict | None:
+    """
+    Return a snapshot's backup_metadata.json if an earlier run wrote it for
+    the same snapshot date, otherwise None.
+    """
+    try:
+        metadata = orjson.loads((repo_path / "backup_metadata.json").read_bytes())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return None
+    # Written by _write_json, which serializes datetimes like isoformat()
+    if metadata.get("snapshot_date") != snapshot_date.isoformat():
+        return None
+    return metadata
+
+
+def _write_json(path: Path, data: dict) -> None:
+    """
+    Write data as indented, key-sorted JSON with orjson, which also
+    serializes datetimes (as ISO 8601) without calling isoformat() first.
+    """
+    path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+
+
 @task()
 def check_snapshot_exists(
     owner: str,
     snapshot_date: datetime,
-    local_backup_dir: Path = Path("./backups/local")
+    local_backup_dir: Path
 ) -> bool:
     """
     Check if a snapshot already exists for the given date.
-    Returns True if both the snapshot directory and manifest exist.
+    Returns True if the snapshot's manifest exists; the flow writes it last,
+    after the snapshot directory, so it alone marks a complete snapshot.
     """
     logger = get_run_logger()
     snapshot_str = snapshot_date.strftime("%Y-%m-%d")
-    snapshot_dir = local_backup_dir / "github" / owner / "repositories" / snapshot_str
-    manifest_path = local_backup_dir / "github" / owner / "repositories" / f"backup_manifest_{snapshot_str}.json"
+    repositories_dir = local_backup_dir / "github" / owner / "repositories"
 
-    if snapshot_dir.exists() and manifest_path.exists():
-        logger.info(f"Snapshot for {snapshot_str} already exists at {snapshot_dir}")
+    # A single stat, independent of how many snapshots have accumulated
+    if (repositories_dir / f"backup_manifest_{snapshot_str}.json").exists():
+        logger.info("Snapshot for %s already exists at %s", snapshot_str, repositories_dir / snapshot_str)
         return True
     return False
 
 
 @task()
-def process_repository(
+async def process_repository(
     repo_info: dict,
-    github_credentials: GitHubCredentials,
+    github_token: str,
     until_date: datetime,
-    local_backup_dir: Path = Path("./backups/local"),
+    snapshot_root: Path,
+    mirrors_dir: Path,
+    partial_clone: bool = False,
+    write_commits_parquet: bool = False,
 ) -> dict:
     """
     Process a single repository: clone, get commits, and backup.
 
     Args:
         repo_info: Repository information dictionary
-        github_credentials: GitHub credentials for authentication
+        github_token: GitHub token, already decrypted once by the flow
         until_date: Cutoff date for commit history (required for idempotency)
-        local_backup_dir: Base directory for backups
+        snapshot_root: Directory of this snapshot (github/<owner>/repositories/<date>)
+        mirrors_dir: Directory of the owner's persistent mirrors
+        partial_clone: Clone without file contents (commit metadata only)
+        write_commits_parquet: Also write the full commit history to
+            commits.parquet (requires pyarrow)
 
     Returns:
         Dictionary with repository backup statistics
     """
-    # FIXED: until_date is now required (no default datetime.now())
+    # until_date is required (no default datetime.now()) so reruns are idempotent
     # Validate that until_date is timezone-aware
     if until_date.tzinfo is None:
         until_date = until_date.replace(tzinfo=timezone.utc)
 
     # Clone to local filesystem
-    local_path = clone_repository_to_local(
+    local_path = await clone_repository_to_local(
         repo_info=repo_info,
-        github_credentials=github_credentials,
-        snapshot_date=until_date,
-        local_backup_dir=local_backup_dir,
+        github_token=github_token,
+        snapshot_root=snapshot_root,
+        mirrors_dir=mirrors_dir,
+        partial_clone=partial_clone,
     )
 
-    # FIXED: Corrected parameter name from local_path to repo_path
-    commits = get_commits_from_local_repo(
-        repo_path=local_path,
-        until_date=until_date,
-    )
-
-    # Save per-repository metadata
-    repo_metadata = {
-        "repo_name": repo_info["name"],
-        "repo_url": repo_info.get("url", ""),
-        "is_fork": repo_info.get("is_fork", False),
-        "is_private": repo_info.get("is_private", False),
-        "snapshot_date": until_date.isoformat(),
-        "backup_timestamp": datetime.now(timezone.utc).isoformat(),
-        "commit_count": len(commits),
-        "commits_sample": commits[:10],  # First 10 commits
-        "local_path": str(local_path),
-    }
+    # A complete snapshot from an earlier run for the same date already
+    # recorded its commit summary; reuse it instead of running git again
+    repo_metadata = _load_backup_metadata(local_path, until_date)
+
+    if repo_metadata is None:
+        # Read the snapshot's commit history and default branch locally
+        default_branch = _read_default_branch(local_path) or repo_info.get("default_branch", "main")
+
+        if write_commits_parquet:
+            # Keep the full history as a columnar table
+            commits = get_commits_from_local_repo(local_path, until_date)
+            _write_commits_parquet(commits, local_path / "commits.parquet")
+            commit_count = len(commits["hash"])
+            # First 10 commits as a sample
+            commits_sample = _commit_rows(commits, 10)
+        else:
+            # Only the count and a sample are needed, so let git do the counting
+            summary = get_commit_summary(local_path, until_date)
+            commit_count = summary["commit_count"]
+            commits_sample = summary["commits_sample"]
+
+        # Save per-repository metadata
+        repo_metadata = {
+            "repo_name": repo_info["name"],
+            "repo_url": repo_info.get("url", ""),
+            "is_fork": repo_info.get("is_fork", False),
+            "is_private": repo_info.get("is_private", False),
+            "default_branch": default_branch,
+            "snapshot_date": until_date,
+            "backup_timestamp": datetime.now(timezone.utc),
+            "commit_count": commit_count,
+            "commits_sample": commits_sample,
+            "local_path": str(local_path),
+        }
 
-    metadata_file = local_path / "backup_metadata.json"
-    with open(metadata_file, "w") as f:
-        json.dump(repo_metadata, f, indent=2, sort_keys=True)
+        _write_json(local_path / "backup_metadata.json", repo_metadata)
 
     result = {
         "repo_name": repo_info["name"],
         "local_path": str(local_path),
         "is_fork": repo_info.get("is_fork", False),
         "is_private": repo_info.get("is_private", False),
-        "commit_count": len(commits),
+        "default_branch": repo_metadata.get("default_branch"),
+        "commit_count": repo_metadata["commit_count"],
         # Return first 10 commits as sample
-        "commits": commits[:10]
+        "commits": repo_metadata["commits_sample"]
     }
     return result
 
 
-@flow()
+@flow(task_runner=ThreadPoolTaskRunner(max_workers=MAX_CONCURRENT_REPOSITORIES))
 def backup_github_repositories(
     owner: str,
     until_date: datetime,
     credentials_block_name: str = "github-credentials",
+    partial_clone: bool = False,
+    write_commits_parquet: bool = False,
 ):
     """
     Main flow to backup all GitHub repositories for a given owner.
@@ -473,6 +1137,10 @@ def backup_github_repositories(
         owner: GitHub username or organization name
         until_date: Snapshot date for idempotent backups (all runs with same date produce identical results)
         credentials_block_name: Name of the Prefect GitHub credentials block
+        partial_clone: Skip file contents (git --filter=blob:none) and back up
+            commit metadata only; off by default so backups stay restorable
+        write_commits_parquet: Write each snapshot's full commit history to
+            commits.parquet; requires the parquet extra (pyarrow)
 
     Returns:
         List of repository backup results
@@ -484,116 +1152,132 @@ def backup_github_repositories(
     # Track workflow start time
     workflow_start = time.time()
 
+    if write_commits_parquet and pyarrow is None:
+        raise ImportError("pyarrow is not installed. Run: pip install 'aqueduct[parquet]'")
+
     # Ensure until_date is timezone-aware
     if until_date.tzinfo is None:
         until_date = until_date.replace(tzinfo=timezone.utc)
 
-    logger.info(f"Starting GitHub backup for {owner} (snapshot date: {until_date.isoformat()})")
+    logger.info("Starting GitHub backup for %s (snapshot date: %s)", owner, until_date.isoformat())
+
+    # Resolve the backup root once; tasks receive it already absolute
+    local_backup_dir = LOCAL_BACKUP_DIR.resolve()
 
     # Check if snapshot already exists (idempotency)
-    if check_snapshot_exists(owner, until_date):
-        logger.info(f"Snapshot already exists and is complete. Skipping backup.")
+    if check_snapshot_exists(owner, until_date, local_backup_dir):
+        logger.info("Snapshot already exists and is complete. Skipping backup.")
         # Optionally load and return existing manifest here
         return []
 
     # Load credentials from custom block and convert to GitHubCredentials
-    github_block = GitHubBlock.load(credentials_block_name)
-    github_credentials = GitHubCredentials(token=github_block.token)
+    github_credentials = _load_github_credentials(credentials_block_name)
+    # Decrypt the token once for every clone instead of once per repository
+    github_token = github_credentials.token.get_secret_value()
 
     # Get all repositories for the owner (sorted for deterministic ordering)
     repositories = get_all_repositories(owner, github_credentials)
 
-    logger.info(f"Found {len(repositories)} repositories for {owner}")
+    logger.info("Found %d repositories for %s", len(repositories), owner)
+
+    # Build the snapshot paths and create the owner's directories once,
+    # instead of from every repository task
+    snapshot_str = until_date.strftime("%Y-%m-%d")
+    owner_dir = local_backup_dir / "github" / owner
+    snapshot_root = owner_dir / "repositories" / snapshot_str
+    mirrors_dir = owner_dir / "mirrors"
+    snapshot_root.mkdir(parents=True, exist_ok=True)
+    mirrors_dir.mkdir(parents=True, exist_ok=True)
+
+    # Submit every repository up front so clones overlap across task runner workers
+    futures = {
+        process_repository.submit(
+            repo_info=repo_info,
+            github_token=github_token,
+            until_date=until_date,
+            snapshot_root=snapshot_root,
+            mirrors_dir=mirrors_dir,
+            partial_clone=partial_clone,
+            write_commits_parquet=write_commits_parquet,
+        ): repo_info
+        for repo_info in repositories
+    }
 
-    # Process each repository - Prefect will automatically parallelize these tasks
     results = []
     failed_repos = []
-
-    for repo_info in repositories:
-        try:
-            result = process_repository(
-                repo_info=repo_info,
-                github_credentials=github_credentials,
-                until_date=until_date,
-            )
-            results.append(result)
-        except Exception as e:
-            # Log error and continue with other repos
-            repo_name = repo_info.get("name", "unknown")
-            logger.error(f"Failed to process repository {repo_name}: {str(e)}")
-
-            # Save error information to backup directory
-            error_info = {
-                "repo_name": repo_name,
-                "repo_url": repo_info.get("url", ""),
-                "is_fork": repo_info.get("is_fork", False),
-                "is_private": repo_info.get("is_private", False),
-                "error_type": type(e).__name__,
-                "error_message": str(e),
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-            }
-
-            # Determine category for error file path
-            if repo_info.get("is_fork", False):
-                category = "forks"
-            elif repo_info.get("is_private", False):
-                category = "private"
-            else:
-                category = "public"
-
-            # Save error file in the repo's expected directory (with timestamp)
-            snapshot_str = until_date.strftime("%Y-%m-%d")
-            error_dir = (
-                Path("./backups/local")
-                / "github"
-                / owner
-                / "repositories"
-                / snapshot_str
-                / category
-                / repo_name
-            )
-            error_dir.mkdir(parents=True, exist_ok=True)
-            error_file = error_dir / "ERROR.json"
-
-            with open(error_file, "w") as f:
-                json.dump(error_info, f, indent=2)
-
-            logger.warning(f"Error details saved to {error_file}")
-            failed_repos.append(error_info)
+    total_commits = 0
+
+    # Each repository's result is appended to an NDJSON file as soon as it
+    # completes, so progress survives a crash and the manifest below only
+    # carries a summary instead of embedding every result
+    repositories_path = owner_dir / "repositories" / f"backup_manifest_{snapshot_str}.ndjson"
+    with open(repositories_path, "wb") as repositories_file:
+        # Handle repositories as they finish, so a failure is recorded right away
+        # instead of waiting behind slower repositories earlier in the list
+        for future in as_completed(futures):
+            repo_info = futures[future]
+            try:
+                result = future.result()
+                repositories_file.write(orjson.dumps(result, option=orjson.OPT_SORT_KEYS) + b"\n")
+                repositories_file.flush()
+                total_commits += result.get("commit_count", 0)
+                results.append(result)
+            except Exception as e:
+                # Log error and continue with other repos
+                repo_name = repo_info.get("name", "unknown")
+                logger.error("Failed to process repository %s: %s", repo_name, e)
+
+                # Save error information to backup directory
+                error_info = {
+                    "repo_name": repo_name,
+                    "repo_url": repo_info.get("url", ""),
+                    "is_fork": repo_info.get("is_fork", False),
+                    "is_private": repo_info.get("is_private", False),
+                    "error_type": type(e).__name__,
+                    "error_message": str(e),
+                    "timestamp": datetime.now(timezone.utc),
+                }
+
+                # Save error file in the repo's expected directory (with timestamp)
+                error_dir = snapshot_root / _repository_category(repo_info) / repo_name
+                error_dir.mkdir(parents=True, exist_ok=True)
+                error_file = error_dir / "ERROR.json"
+
+                _write_json(error_file, error_info)
+
+                logger.warning("Error details saved to %s", error_file)
+                failed_repos.append(error_info)
+
+    # Completion order varies between runs; keep the returned results and the
+    # manifest's failure list deterministic
+    results.sort(key=operator.itemgetter("repo_name"))
+    failed_repos.sort(key=operator.itemgetter("repo_name"))
 
     # Save backup manifest with enhanced metadata
-    snapshot_str = until_date.strftime("%Y-%m-%d")
     manifest = {
-        "backup_date": until_date.isoformat(),
+        "backup_date": until_date,
         "snapshot_date_str": snapshot_str,
-        "execution_timestamp": datetime.now(timezone.utc).isoformat(),
-        "workflow_version": "2.0.0",
+        "execution_timestamp": datetime.now(timezone.utc),
+        "workflow_version": "3.0.0",
         "python_version": sys.version,
         "owner": owner,
         "repository_count": len(results),
-        "total_commits": sum(r.get("commit_count", 0) for r in results),
+        "total_commits": total_commits,
         "processing_duration_seconds": time.time() - workflow_start,
-        "repositories": results,
+        # One JSON object per successfully backed up repository, in completion order
+        "repositories_file": repositories_path.name,
         "failed_count": len(failed_repos),
         "failed_repositories": failed_repos,
     }
 
     # Update manifest path to include timestamp
-    manifest_path = (
-        Path("./backups/local")
-        / "github"
-        / owner
-        / "repositories"
-        / f"backup_manifest_{snapshot_str}.json"
-    )
-    manifest_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(manifest_path, "w") as f:
-        json.dump(manifest, f, indent=2, sort_keys=True)
+    manifest_path = owner_dir / "repositories" / f"backup_manifest_{snapshot_str}.json"
+    _write_json(manifest_path, manifest)
 
-    logger.info(f"Successfully backed up {len(results)} repositories")
+    logger.info("Successfully backed up %d repositories", len(results))
     if failed_repos:
-        logger.warning(f"Failed to backup {len(failed_repos)} repositories (see ERROR.json files for details)")
-    logger.info(f"Manifest saved to {manifest_path}")
+        logger.warning("Failed to backup %d repositories (see ERROR.json files for details)", len(failed_repos))
+    logger.info("Manifest saved to %s", manifest_path)
 
     return results
 